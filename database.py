@@ -1,5 +1,5 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from functools import lru_cache
 import os
 from dotenv import load_dotenv  # Paquete para manejar .env
 
@@ -12,12 +12,42 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("No se configuró DATABASE_URL en las variables de entorno")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Render entrega URLs postgres:// o postgresql://; el motor async necesita el driver asyncpg
+for prefijo in ("postgres://", "postgresql://"):
+    if DATABASE_URL.startswith(prefijo):
+        DATABASE_URL = "postgresql+asyncpg://" + DATABASE_URL[len(prefijo):]
+        break
 
-def get_db():
-    db = SessionLocal()
-    try:
+# Conexiones a Postgres para toda la instancia, repartidas entre los workers de Gunicorn
+# (cada uno tiene su propio pool). Con los valores por defecto: 20 // 2 = 10 por worker,
+# 5 fijas y 5 de desborde. Ajustar DB_MAX_CONNECTIONS según el max_connections del plan
+# de Postgres, dividido entre las instancias que comparten la base de datos.
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "2"))
+
+_CONEXIONES_POR_WORKER = max(2, DB_MAX_CONNECTIONS // WEB_CONCURRENCY)
+POOL_SIZE = _CONEXIONES_POR_WORKER // 2
+MAX_OVERFLOW = _CONEXIONES_POR_WORKER - POOL_SIZE
+
+@lru_cache(maxsize=1)
+def get_engine():
+    """Motor único por proceso; el pool y sus conexiones se reutilizan entre peticiones"""
+    # Caché de sentencias preparadas de asyncpg: las consultas de main.py son fijas y se reutilizan
+    return create_async_engine(
+        DATABASE_URL,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_pre_ping=False,
+        pool_recycle=3600,
+        connect_args={
+            "statement_cache_size": 512,
+            "prepared_statement_cache_size": 512
+        }
+    )
+
+engine = get_engine()
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
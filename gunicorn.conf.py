@@ -0,0 +1,27 @@
+import os
+
+# Uso: gunicorn main:app -c gunicorn.conf.py
+# uvicorn[standard] aporta uvloop y httptools al worker
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Presupuesto por instancia (mismo WEB_CONCURRENCY que leen database.py y hash_service.py;
+# definirlo como variable de entorno en lugar de usar -w para que los tres coincidan):
+#   workers                 = WEB_CONCURRENCY (2)
+#   procesos de hashing     = workers × HASH_PROCESSES (2 × 1 = 2)
+#   memoria Argon2 (pico)   = procesos de hashing × ARGON2_MEMORY_COST (2 × 64 MiB = 128 MiB)
+#   conexiones a Postgres   = DB_MAX_CONNECTIONS (20), repartidas entre los workers
+# No se usa os.cpu_count(): dentro de un contenedor devuelve los núcleos del host, no los del plan.
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+
+# Cargar la app antes del fork para compartir (copy-on-write) bcrypt, SQLAlchemy y las consultas compiladas.
+# Con preload, nada que abra procesos, hilos, pipes, sockets o conexiones puede crearse al importar
+# (todos los workers heredarían el mismo): va en el evento startup de main.py, que corre en cada
+# worker después del fork, como el pool de hashing y la reserva de sales de hash_service.
+preload_app = True
+keepalive = 5
+
+# No se usa forwarded_allow_ips = "*": uvicorn tomaría la primera IP de X-Forwarded-For,
+# que controla el cliente, y cada IP inventada tendría su propio límite de peticiones.
+# La IP del cliente para el límite la obtiene main._ip_cliente (ver PROXY_HOPS).
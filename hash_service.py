@@ -0,0 +1,121 @@
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+# Parámetros de Argon2id para contraseñas nuevas. Subirlos encarece cada login y
+# registro, pero también cada intento de fuerza bruta sobre los hashes; bajarlos
+# solo en desarrollo. Los hashes guardados con otros parámetros se siguen
+# verificando y login los vuelve a generar (ver needs_rehash).
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", str(64 * 1024)))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "2"))
+
+_ph = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM
+)
+
+# El hashing corre en procesos aparte para no competir por el GIL con el parseo y la
+# serialización de las peticiones. En total hay WEB_CONCURRENCY × HASH_PROCESSES
+# procesos, cada uno con hasta ARGON2_MEMORY_COST de memoria por hash (ver el
+# presupuesto en gunicorn.conf.py). Login y registro tienen límite de peticiones,
+# así que uno o dos por worker bastan.
+HASH_PROCESSES = int(os.getenv("HASH_PROCESSES", "1"))
+
+# El pool no se crea al importar: ProcessPoolExecutor abre sus colas y pipes en el
+# constructor y, con preload_app, todos los workers de Gunicorn heredarían los mismos
+# y se leerían los trabajos y resultados entre sí. Cada worker crea el suyo (warm_up);
+# el pid detecta un pool heredado de otro proceso.
+_executor = None
+_executor_pid = None
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(max_workers=HASH_PROCESSES)
+        _executor_pid = os.getpid()
+    return _executor
+
+class SaltPool:
+    """Reserva circular de sales aleatorias de 16 bytes generadas por lotes.
+
+    Cada recarga lee todas las sales con una sola llamada a os.urandom en vez de
+    una lectura de entropía por registro. Cuando quedan menos del 25% se programa
+    la siguiente recarga en el event loop.
+    """
+
+    def __init__(self, size: int = 256, salt_len: int = 16):
+        self._size = size
+        self._salt_len = salt_len
+        self._salts = deque()
+        self._refill_pending = False
+
+    def _refill(self) -> None:
+        self._refill_pending = False
+        n = self._salt_len
+        entropy = os.urandom(n * (self._size - len(self._salts)))
+        self._salts.extend(entropy[i:i + n] for i in range(0, len(entropy), n))
+
+    def get(self) -> bytes:
+        if not self._salts:
+            self._refill()
+        salt = self._salts.popleft()
+        if not self._refill_pending and len(self._salts) < self._size // 4:
+            self._refill_pending = True
+            asyncio.get_running_loop().call_soon(self._refill)
+        return salt
+
+# Se crea vacía: si se llenara al importar, con preload_app todos los workers de
+# Gunicorn heredarían las mismas sales al hacer fork
+_salt_pool = SaltPool()
+
+def warm_up() -> None:
+    """Crea el pool de hashing y llena la reserva de sales; llamar al arrancar cada worker (después del fork)"""
+    _get_executor()
+    _salt_pool._refill()
+
+def shutdown() -> None:
+    """Detiene los procesos de hashing de este worker"""
+    global _executor
+    if _executor is not None and _executor_pid == os.getpid():
+        _executor.shutdown(cancel_futures=True)
+    _executor = None
+
+def _es_bcrypt(hashed: str) -> bool:
+    return hashed.startswith("$2")
+
+def _hash(password: str, salt: bytes) -> str:
+    return _ph.hash(password, salt=salt)
+
+def _verify(password: str, hashed: str) -> bool:
+    # Las cuentas creadas antes de Argon2id conservan su hash bcrypt hasta el siguiente login.
+    # bcrypt solo usa los primeros 72 bytes; se truncan aquí como hacía al crear el hash
+    if _es_bcrypt(hashed):
+        return bcrypt.checkpw(password.encode('utf-8')[:72], hashed.encode('utf-8'))
+    try:
+        return _ph.verify(hashed, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+# Hash de relleno para /login/ cuando el usuario no existe: mismo costo que una cuenta real
+DUMMY_HASH = _ph.hash("x")
+
+async def hash_password(password: str) -> str:
+    """Genera el hash Argon2id de una contraseña sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _hash, password, _salt_pool.get())
+
+async def verify_password(password: str, hashed: str) -> bool:
+    """Verifica una contraseña contra su hash (Argon2id o bcrypt) sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _verify, password, hashed)
+
+def needs_rehash(hashed: str) -> bool:
+    """Indica si el hash es bcrypt o usa parámetros de Argon2id distintos a los actuales"""
+    return _es_bcrypt(hashed) or _ph.check_needs_rehash(hashed)
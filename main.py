@@ -1,31 +1,147 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Query
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, HTTPException, Depends, status, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-import bcrypt
-from pydantic import BaseModel, EmailStr, validator, Field
+import hash_service
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator, model_validator
 from typing import Optional, List
 from datetime import datetime
+import anyio
+import hashlib
+import hmac
 import logging
+import os
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from database import get_db
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from cachetools import TTLCache
+from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
+from database import get_db, SessionLocal
 import json
+from itertools import product
+import orjson
 
 # Configuración básica de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Inicializa la app FastAPI
-app = FastAPI()
+# Formato de fecha que espera el frontend (antes se generaba con TO_CHAR en SQL)
+FORMATO_FECHA_HORA = "%d/%m/%Y – %I:%M %p"
+FORMATO_FECHA = "%d/%m/%Y"
+FORMATO_FECHA_REPORTE = "%d %b %Y"
+FORMATO_HORA = "%I:%M %p"
+
+# Caché de cuentas para /login/ (nombre_usuario -> fila con id_cuenta y contrasena_hash).
+# TTL corto para que eliminaciones y cambios de contraseña se reflejen rápido.
+_USER_CACHE = TTLCache(maxsize=10_000, ttl=30)
+
+# Caché de logins correctos (HMAC de usuario + contraseña -> id_cuenta) para que los
+# reintentos del mismo cliente no vuelvan a calcular el hash. Nunca guarda fallos.
+# La clave es aleatoria por proceso: lo guardado en memoria no sirve para atacar contraseñas.
+_AUTH_CACHE = TTLCache(maxsize=4096, ttl=60)
+_AUTH_CACHE_KEY = os.urandom(32)
+
+# Cuerpos ya serializados de /personas/ y /reportes/ (el panel los consulta seguido).
+# Se invalidan al modificar los datos en este proceso; el TTL acota lo que puedan
+# tardar en verse los cambios hechos desde otro worker.
+_LISTADOS_CACHE = TTLCache(maxsize=2, ttl=60)
+
+# Generación de cada listado: sube al invalidarlo. Una transmisión guarda su cuerpo solo si
+# la generación no cambió desde que empezó; si no, volvería a poner la foto anterior a la escritura.
+_LISTADOS_GENERACION = {"personas": 0, "reportes": 0}
+
+def _invalidar_listados(*claves):
+    """Descarta los listados indicados (todos si no se indica ninguno)"""
+    for clave in claves or tuple(_LISTADOS_GENERACION):
+        _LISTADOS_CACHE.pop(clave, None)
+        _LISTADOS_GENERACION[clave] += 1
+
+# Detalle de accesos (id_acceso -> respuesta). Un registro de acceso no cambia una vez
+# creado, así que el TTL es más largo; acotado en tamaño para no crecer sin límite.
+_DETALLE_CACHE = TTLCache(maxsize=1024, ttl=300)
+
+def _clave_login(username: str, password: str) -> bytes:
+    mensaje = username.encode('utf-8') + b"\x00" + password.encode('utf-8')
+    return hmac.new(_AUTH_CACHE_KEY, mensaje, hashlib.sha256).digest()
+
+# Inicializa la app FastAPI (orjson serializa las respuestas más rápido que json)
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Configura CORS. Define CORS_ORIGINS con los dominios del frontend separados por comas
+# (ej. "https://biogate.example.com,https://admin.biogate.example.com"); "*" solo en desarrollo.
+# Sin definir no se permite ningún origen: un despliegue mal configurado no queda abierto.
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
+if not CORS_ORIGINS:
+    logger.warning("CORS_ORIGINS no está definido: se rechazan las peticiones de navegador de otros orígenes")
 
-# Configura CORS
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # En producción, restringe esto a tus dominios
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_headers=["authorization", "content-type"],
+    max_age=86400,  # El navegador cachea el preflight (OPTIONS) por un día
 )
 
+# Comprime respuestas grandes (listados de historial, personas y reportes)
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
+# Proxies delante de la app (Render: 1). Cada proxy añade al final de X-Forwarded-For
+# la IP de quien le habló; las entradas más a la izquierda las puede inventar el cliente,
+# así que solo se confía en la que añadió el último proxy. 0 si no hay proxy.
+PROXY_HOPS = int(os.getenv("PROXY_HOPS", "1"))
+
+def _ip_cliente(request: Request) -> str:
+    if PROXY_HOPS > 0:
+        cabecera = ",".join(request.headers.getlist("x-forwarded-for"))
+        ips = [ip.strip() for ip in cabecera.split(",") if ip.strip()]
+        if len(ips) >= PROXY_HOPS:
+            return ips[-PROXY_HOPS]
+    return get_remote_address(request)
+
+# Límite de peticiones por IP en los endpoints que calculan hashes de contraseña.
+# Con RATE_LIMIT_STORAGE_URI=redis://... el conteo se comparte entre workers de Gunicorn.
+limiter = Limiter(
+    key_func=_ip_cliente,
+    storage_uri=os.getenv("RATE_LIMIT_STORAGE_URI", "memory://"),
+    headers_enabled=True  # X-RateLimit-* y Retry-After en las respuestas
+)
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+@app.exception_handler(RequestValidationError)
+async def error_validacion(request: Request, exc: RequestValidationError):
+    # Pydantic v2 incluye en cada error el valor recibido ("input"); en login y registro
+    # eso devolvería las contraseñas en texto plano en la respuesta 422
+    errores = [{k: v for k, v in e.items() if k != "input"} for e in exc.errors()]
+    return ORJSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        content={"detail": jsonable_encoder(errores)}
+    )
+
+@app.on_event("startup")
+async def llenar_reserva_sales():
+    # Corre en cada worker, después del fork: crea su pool de hashing y el primer
+    # registro no paga la generación de sales
+    hash_service.warm_up()
+
+@app.on_event("shutdown")
+async def detener_hashing():
+    hash_service.shutdown()
+
 # --- Modelos Pydantic ---
+
+# Longitud de contraseña en bytes UTF-8. Se valida antes de calcular cualquier hash
+# para que una contraseña enorme no cueste CPU (bcrypt además ignoraba lo que pasa de 72)
+PASSWORD_MIN_BYTES = 8
+PASSWORD_MAX_BYTES = 72
+
+# Tope para /login/, más holgado: cuentas bcrypt antiguas pueden tener contraseñas de
+# más de 72 bytes (bcrypt las truncaba) y deben poder seguir entrando
+LOGIN_PASSWORD_MAX_BYTES = 1024
+
 class UserLogin(BaseModel):
     username: str
     password: str
@@ -41,12 +157,21 @@ class RegistroCuenta(BaseModel):
     password: str  # Contraseña
     confirmPassword: str  # Confirmación de contraseña
 
-    @validator('confirmPassword')
-    def passwords_match(cls, v, values):
-        if 'password' in values and v != values['password']:
-            raise ValueError('Las contraseñas no coinciden')
+    @field_validator('password')
+    @classmethod
+    def password_length(cls, v):
+        if not PASSWORD_MIN_BYTES <= len(v.encode('utf-8')) <= PASSWORD_MAX_BYTES:
+            raise ValueError(
+                f'La contraseña debe tener entre {PASSWORD_MIN_BYTES} y {PASSWORD_MAX_BYTES} bytes'
+            )
         return v
 
+    @model_validator(mode='after')
+    def passwords_match(self):
+        if self.confirmPassword != self.password:
+            raise ValueError('Las contraseñas no coinciden')
+        return self
+
 class UsuarioRegistro(BaseModel):
     persona: RegistroPersona
     cuenta: RegistroCuenta
@@ -83,12 +208,14 @@ class HistorialAcceso(BaseModel):
     foto_url: Optional[str] = None
 
 class HistorialFiltrado(BaseModel):
-    fecha_inicio: Optional[str] = None
-    fecha_fin: Optional[str] = None
+    fecha_inicio: Optional[datetime] = None  # asyncpg exige datetime, no str
+    fecha_fin: Optional[datetime] = None
     resultado: Optional[str] = None
     nombre: Optional[str] = None
 
 class PersonaResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)  # Esto permite la conversión desde ORM models
+
     id_persona: int
     nombre: str
     apellido_paterno: str
@@ -98,23 +225,22 @@ class PersonaResponse(BaseModel):
     activo: bool
     fecha_registro: datetime
 
-    class Config:
-        from_attributes = True  # Esto permite la conversión desde ORM models
-
 class ActualizarEstadoPersona(BaseModel):
     activo: bool
 
 class ReporteCreate(BaseModel):
     titulo: str
     descripcion: str
-    tipo_reporte: str = Field(..., regex="^(Error del sistema|Fallo autenticación|Fallo de dispositivo|Acceso no autorizado|Horario irregular|Otros)$")
-    severidad: Optional[str] = Field(None, regex="^(Baja|Media|Alta|Crítica)$")
+    tipo_reporte: str = Field(..., pattern="^(Error del sistema|Fallo autenticación|Fallo de dispositivo|Acceso no autorizado|Horario irregular|Otros)$")
+    severidad: Optional[str] = Field(None, pattern="^(Baja|Media|Alta|Crítica)$")
     id_acceso_relacionado: Optional[int] = None
     id_dispositivo: Optional[int] = None
     etiquetas: Optional[dict] = None
     evidencias: Optional[List[str]] = None
 
 class ReporteResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)  # Permite la conversión desde ORM models
+
     id_reporte: int
     titulo: str
     descripcion: str
@@ -127,39 +253,302 @@ class ReporteResponse(BaseModel):
     ubicacion: str
     evidencias: Optional[List[str]] = None
 
-    class Config:
-        from_attributes = True  # Permite la conversión desde ORM models
+# --- Consultas SQL (se construyen una sola vez al importar el módulo) ---
+_Q_LOGIN = text("""
+    SELECT id_cuenta, contrasena_hash 
+    FROM cuentas 
+    WHERE nombre_usuario = :username
+    LIMIT 1
+""")
+
+_Q_ACTUALIZAR_HASH = text("""
+    UPDATE cuentas SET contrasena_hash = :contrasena_hash WHERE id_cuenta = :id_cuenta
+""")
+
+_Q_REGISTRAR = text("""
+    -- fecha_registro y ultimo_acceso toman DEFAULT now() (migración 011)
+    WITH nueva_persona AS (
+        INSERT INTO personas (
+            nombre, apellido_paterno, apellido_materno, 
+            telefono, correo_electronico, activo
+        ) 
+        VALUES (
+            :nombre, :apellido_paterno, :apellido_materno, 
+            :telefono, :correo, TRUE
+        )
+        ON CONFLICT (correo_electronico) DO NOTHING
+        RETURNING id_persona
+    )
+    INSERT INTO cuentas (
+        id_persona, id_rol, nombre_usuario, 
+        contrasena_hash
+    ) 
+    SELECT
+        id_persona, 
+        1,  -- Rol de Administrador
+        :nombre_usuario, 
+        :contrasena_hash  -- Incluye la sal (formato PHC de Argon2id)
+    FROM nueva_persona
+    ON CONFLICT (nombre_usuario) DO NOTHING
+    RETURNING id_persona
+""")
+
+# Variantes precompiladas de GET /historial-accesos/, una por combinación de filtros
+_HISTORIAL_COLUMNAS = """
+    SELECT 
+        ha.id_acceso,
+        CASE 
+            WHEN p.nombre IS NULL THEN 'DESCONOCIDO'
+            ELSE p.nombre_completo
+        END as nombre_completo,
+        ha.fecha,
+        CASE 
+            WHEN ha.resultado = 'Éxito' THEN 'PERMITIDO'
+            ELSE 'DENEGADO'
+        END as resultado,
+        COALESCE(d.ubicacion, 'Desconocida') as dispositivo,
+        ha.foto_url
+"""
+
+_HISTORIAL_JOINS = """
+    LEFT JOIN personas p ON ha.id_persona = p.id_persona
+    LEFT JOIN dispositivos d ON ha.id_dispositivo = d.id_dispositivo
+"""
+
+# Solo columnas del índice de cobertura (migración 010): la página sale de un index-only scan
+_HISTORIAL_PAGINA = """
+    WITH pagina AS (
+        SELECT ha.id_acceso, ha.fecha, ha.id_persona, ha.id_dispositivo, ha.resultado, ha.foto_url
+        FROM historial_accesos ha
+        WHERE 1=1
+"""
+
+_HISTORIAL_ORDEN = "ORDER BY ha.fecha DESC, ha.id_acceso DESC"
+
+# nombre_busqueda es una columna generada con índice trigram (migración 004)
+_HISTORIAL_FILTRO_NOMBRE = """
+    AND (
+        p.nombre_busqueda LIKE :nombre
+        OR (:incluir_desconocidos AND p.id_persona IS NULL)
+    )
+"""
+
+_HISTORIAL_FILTRO_FECHAS = "AND ha.fecha BETWEEN :fecha_inicio AND :fecha_fin"
+
+_HISTORIAL_FILTRO_RESULTADO = {
+    None: "",
+    "PERMITIDO": "AND ha.resultado = 'Éxito'",
+    "DENEGADO": "AND ha.resultado != 'Éxito'",
+}
+
+_HISTORIAL_CURSOR = {
+    None: "",
+    "id": """
+        AND (ha.fecha, ha.id_acceso) < (
+            SELECT fecha, id_acceso FROM historial_accesos WHERE id_acceso = :after_id
+        )
+    """,
+}
+
+def _componer_historial(con_nombre: bool, con_fechas: bool, resultado: Optional[str], cursor: Optional[str]):
+    filtros = []
+    if con_fechas:
+        filtros.append(_HISTORIAL_FILTRO_FECHAS)
+    filtros.append(_HISTORIAL_FILTRO_RESULTADO[resultado])
+    filtros.append(_HISTORIAL_CURSOR[cursor])
+
+    if con_nombre:
+        # El filtro por nombre necesita el join con personas antes del LIMIT
+        partes = [
+            _HISTORIAL_COLUMNAS, "FROM historial_accesos ha", _HISTORIAL_JOINS,
+            "WHERE 1=1", _HISTORIAL_FILTRO_NOMBRE, *filtros,
+            _HISTORIAL_ORDEN, "LIMIT :limite"
+        ]
+    else:
+        # Primero se eligen las filas de la página y solo esas se unen con
+        # personas y dispositivos (top-N antes del join)
+        partes = [
+            _HISTORIAL_PAGINA, *filtros, _HISTORIAL_ORDEN, "LIMIT :limite", ")",
+            _HISTORIAL_COLUMNAS, "FROM pagina ha", _HISTORIAL_JOINS,
+            _HISTORIAL_ORDEN
+        ]
+    return text("\n".join(partes))
+
+_Q_HISTORIAL = {
+    clave: _componer_historial(*clave)
+    for clave in product((False, True), (False, True), _HISTORIAL_FILTRO_RESULTADO, _HISTORIAL_CURSOR)
+}
+
+_Q_DETALLE_ACCESO = text("""
+    SELECT 
+        ha.id_acceso,
+        CASE 
+            WHEN p.nombre IS NULL THEN 'DESCONOCIDO'
+            ELSE p.nombre_completo
+        END as nombre_completo,
+        ha.fecha,
+        hp.hora_entrada,
+        hp.hora_salida,
+        hp.dias_laborales,
+        CASE 
+            WHEN ha.resultado = 'Éxito' THEN 'PERMITIDO'
+            ELSE 'DENEGADO'
+        END as estatus,
+        COALESCE(d.nombre, 'Desconocido') as nombre_dispositivo,
+        COALESCE(d.ubicacion, 'Desconocida') as ubicacion_dispositivo,
+        ha.confianza,
+        ha.estado_registro,
+        ha.es_dia_laboral,
+        COALESCE(ha.razon, 'N/A') as razon,
+        ha.foto_url
+    FROM historial_accesos ha
+    LEFT JOIN personas p ON ha.id_persona = p.id_persona
+    LEFT JOIN dispositivos d ON ha.id_dispositivo = d.id_dispositivo
+    LEFT JOIN horarios_persona hp ON ha.id_persona = hp.id_persona
+    WHERE ha.id_acceso = :id_acceso
+""")
+
+_Q_PERSONAS = text("""
+    SELECT 
+        id_persona,
+        nombre,
+        apellido_paterno,
+        apellido_materno,
+        correo_electronico,
+        telefono,
+        activo,
+        fecha_registro
+    FROM personas
+    ORDER BY nombre, apellido_paterno
+""")
+
+_Q_ACTUALIZAR_ESTADO = text("""
+    UPDATE personas 
+    SET activo = :activo 
+    WHERE id_persona = :id_persona
+    RETURNING id_persona
+""")
+
+# Valida el acceso y el dispositivo relacionados e inserta el reporte en un solo viaje.
+# Si alguno no existe no se inserta nada y id_reporte vuelve NULL.
+_Q_INSERTAR_REPORTE = text("""
+    WITH validacion AS (
+        SELECT
+            (CAST(:id_acceso_relacionado AS integer) IS NULL OR EXISTS (
+                SELECT 1 FROM historial_accesos WHERE id_acceso = :id_acceso_relacionado
+            )) AS acceso_existe,
+            (CAST(:id_dispositivo AS integer) IS NULL OR EXISTS (
+                SELECT 1 FROM dispositivos WHERE id_dispositivo = :id_dispositivo
+            )) AS dispositivo_existe
+    ),
+    nuevo_reporte AS (
+        INSERT INTO reportes (
+            titulo, descripcion, tipo_reporte, severidad, estado,
+            fecha_generacion, id_acceso_relacionado, id_dispositivo,
+            etiquetas, evidencias
+        )
+        SELECT
+            :titulo, :descripcion, :tipo_reporte, :severidad, 'Abierto',
+            CURRENT_TIMESTAMP, :id_acceso_relacionado, :id_dispositivo,
+            :etiquetas, :evidencias
+        FROM validacion
+        WHERE acceso_existe AND dispositivo_existe
+        RETURNING id_reporte
+    )
+    SELECT
+        acceso_existe,
+        dispositivo_existe,
+        (SELECT id_reporte FROM nuevo_reporte) AS id_reporte
+    FROM validacion
+""")
+
+_Q_REPORTES = text("""
+    SELECT 
+        r.id_reporte,
+        r.titulo,
+        r.descripcion,
+        r.tipo_reporte,
+        r.severidad,
+        r.estado,
+        r.fecha_generacion,
+        COALESCE(CONCAT(p.nombre, ' ', p.apellido_paterno), 'Desconocido') as nombre,
+        COALESCE(d.ubicacion, 'N/A') as ubicacion,
+        r.evidencias
+    FROM reportes r
+    LEFT JOIN historial_accesos ha ON r.id_acceso_relacionado = ha.id_acceso
+    LEFT JOIN personas p ON ha.id_persona = p.id_persona
+    LEFT JOIN dispositivos d ON r.id_dispositivo = d.id_dispositivo
+    ORDER BY r.fecha_generacion DESC
+""")
+
+_Q_EXISTE_PERSONA = text("SELECT 1 FROM personas WHERE id_persona = :id")
+
+_Q_ELIMINAR_PERSONA = text("DELETE FROM personas WHERE id_persona = :id_persona")
+
 # --- Endpoints ---
-@app.get("/")
-def read_root():
-    return {
-        "message": "API de autenticación funcionando",
-        "status": "active",
-        "endpoints": {
-            "login": "POST /login/",
-            "register": "POST /registrar/",
-            "historial": "GET /historial-accesos/",
-            "generate_password": "GET /generate-password/",
-            "docs": "/docs"
-        }
+
+# Respuestas fijas serializadas una sola vez al importar el módulo.
+# Se crea un Response nuevo por petición porque los middlewares (CORS) modifican sus headers.
+_ROOT_BYTES = orjson.dumps({
+    "message": "API de autenticación funcionando",
+    "status": "active",
+    "endpoints": {
+        "login": "POST /login/",
+        "register": "POST /registrar/",
+        "historial": "GET /historial-accesos/",
+        "historial_export": "GET /historial-accesos.ndjson",
+        "generate_password": "GET /generate-password/",
+        "docs": "/docs"
     }
+})
+_HEALTH_BYTES = orjson.dumps({"status": "ok", "service": "auth-api"})
+
+@app.get("/")
+async def read_root():
+    return Response(content=_ROOT_BYTES, media_type="application/json")
 
 @app.post("/login/")
-def login(user: UserLogin, db: Session = Depends(get_db)):
+@limiter.limit("5/minute")
+async def login(request: Request, response: Response, user: UserLogin, db: AsyncSession = Depends(get_db)):
     try:
         logger.info(f"Intento de login para: {user.username}")
 
-        # 1. Buscar usuario en la base de datos
-        query = text("""
-            SELECT id_cuenta, contrasena_hash 
-            FROM cuentas 
-            WHERE nombre_usuario = :username
-            LIMIT 1
-        """)
-        result = db.execute(query, {"username": user.username})
-        user_db = result.fetchone()
+        # Sin mínimo aquí: cuentas anteriores a la regla pueden tener contraseñas más cortas.
+        # Una contraseña vacía o enorme se rechaza como credenciales inválidas, sin calcular hash
+        if not user.password or len(user.password.encode('utf-8')) > LOGIN_PASSWORD_MAX_BYTES:
+            logger.warning("Contraseña con longitud inválida")
+            raise HTTPException(
+                status_code=401,
+                detail="Credenciales inválidas",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+
+        # 0. Mismas credenciales verificadas hace poco: responder sin calcular el hash
+        clave = _clave_login(user.username, user.password)
+        id_cuenta = _AUTH_CACHE.get(clave)
+        if id_cuenta is not None:
+            logger.info("Autenticación exitosa (caché)")
+            return {
+                "status": "success",
+                "user_id": id_cuenta,
+                "message": "Autenticación exitosa"
+            }
+
+        # 1. Buscar usuario (primero en caché, luego en la base de datos)
+        user_db = _USER_CACHE.get(user.username)
+        if user_db is None:
+            result = await db.execute(_Q_LOGIN, {"username": user.username})
+            user_db = result.mappings().first()
+            if user_db:
+                _USER_CACHE[user.username] = user_db
+
+        # Devolver la conexión al pool antes de verificar el hash
+        await db.close()
 
         if not user_db:
+            # Verificar igual contra un hash de relleno para no revelar por tiempo
+            # de respuesta qué nombres de usuario existen
+            await hash_service.verify_password(user.password, hash_service.DUMMY_HASH)
             logger.warning("Usuario no encontrado")
             raise HTTPException(
                 status_code=401,
@@ -167,11 +556,8 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
                 headers={"WWW-Authenticate": "Bearer"}
             )
 
-        # 2. Verificar contraseña con bcrypt
-        if not bcrypt.checkpw(
-            user.password.encode('utf-8'),
-            user_db.contrasena_hash.encode('utf-8')
-        ):
+        # 2. Verificar contraseña (en otro proceso para no bloquear el event loop)
+        if not await hash_service.verify_password(user.password, user_db["contrasena_hash"]):
             logger.warning("Contraseña incorrecta")
             raise HTTPException(
                 status_code=401,
@@ -179,10 +565,26 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
                 headers={"WWW-Authenticate": "Bearer"}
             )
 
+        # 3. Migrar hashes bcrypt (o con parámetros viejos) a Argon2id tras un login correcto
+        if hash_service.needs_rehash(user_db["contrasena_hash"]):
+            try:
+                nuevo_hash = await hash_service.hash_password(user.password)
+                await db.execute(
+                    _Q_ACTUALIZAR_HASH,
+                    {"contrasena_hash": nuevo_hash, "id_cuenta": user_db["id_cuenta"]}
+                )
+                await db.commit()
+                _USER_CACHE.pop(user.username, None)
+            except Exception as e:
+                # El login ya es válido; se reintentará en el siguiente
+                await db.rollback()
+                logger.warning(f"No se pudo actualizar el hash de la cuenta: {str(e)}")
+
+        _AUTH_CACHE[clave] = user_db["id_cuenta"]
         logger.info("Autenticación exitosa")
         return {
             "status": "success",
-            "user_id": user_db.id_cuenta,
+            "user_id": user_db["id_cuenta"],
             "message": "Autenticación exitosa"
         }
 
@@ -196,90 +598,52 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
         )
 
 @app.post("/registrar/", status_code=status.HTTP_201_CREATED)
-def registrar_usuario(usuario: UsuarioRegistro, db: Session = Depends(get_db)):
+@limiter.limit("5/minute")
+async def registrar_usuario(
+    request: Request,
+    response: Response,
+    usuario: UsuarioRegistro,
+    db: AsyncSession = Depends(get_db)
+):
     try:
         logger.info(f"Intento de registro para: {usuario.persona.email}")
 
-        # Verificar si el correo ya existe
-        correo_existente = db.execute(
-            text("SELECT 1 FROM personas WHERE correo_electronico = :correo"),
-            {"correo": usuario.persona.email}
-        ).scalar()
-
-        if correo_existente:
+        # El nombre de usuario es la parte local del correo
+        nombre_usuario = usuario.persona.email.partition('@')[0]
+        if not (nombre_usuario and nombre_usuario.isascii() and len(nombre_usuario) < 64):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="El correo electrónico ya está registrado"
+                detail="El correo no genera un nombre de usuario válido"
             )
 
-        # Verificar si el nombre de usuario ya existe
-        nombre_usuario = usuario.persona.email.split('@')[0]
-        usuario_existente = db.execute(
-            text("SELECT 1 FROM cuentas WHERE nombre_usuario = :username"),
-            {"username": nombre_usuario}
-        ).scalar()
-
-        if usuario_existente:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="El nombre de usuario ya está en uso"
-            )
+        # Hashear contraseña (en un hilo para no bloquear el event loop)
+        hashed_password = await hash_service.hash_password(usuario.cuenta.password)
 
-        # Hashear contraseña
-        hashed_password = bcrypt.hashpw(
-            usuario.cuenta.password.encode('utf-8'),
-            bcrypt.gensalt()
-        ).decode('utf-8')
-
-        # Insertar persona
-        result_persona = db.execute(
-            text("""
-                INSERT INTO personas (
-                    nombre, apellido_paterno, apellido_materno, 
-                    telefono, correo_electronico, fecha_registro, activo
-                ) 
-                VALUES (
-                    :nombre, :apellido_paterno, :apellido_materno, 
-                    :telefono, :correo, :fecha_registro, TRUE
-                )
-                RETURNING id_persona
-            """),
+        # Insertar persona y cuenta en un solo viaje a la base de datos.
+        # Si el correo o el nombre de usuario ya existen, ON CONFLICT no inserta
+        # la cuenta y no se devuelve fila (el rollback descarta la persona).
+        result_registro = await db.execute(
+            _Q_REGISTRAR,
             {
                 "nombre": usuario.persona.name,
                 "apellido_paterno": usuario.persona.lastName,
                 "apellido_materno": usuario.persona.secondLastName,
                 "telefono": usuario.persona.phone,
                 "correo": usuario.persona.email,
-                "fecha_registro": datetime.now()
-            }
-        )
-        id_persona = result_persona.scalar_one()
-
-        # Insertar cuenta
-        db.execute(
-            text("""
-                INSERT INTO cuentas (
-                    id_persona, id_rol, nombre_usuario, 
-                    contrasena_hash, sal, ultimo_acceso
-                ) 
-                VALUES (
-                    :id_persona, 
-                    1,  -- Rol de Administrador
-                    :nombre_usuario, 
-                    :contrasena_hash, 
-                    '',  -- Sal (ya incluida en bcrypt)
-                    :ultimo_acceso
-                )
-            """),
-            {
-                "id_persona": id_persona,
                 "nombre_usuario": nombre_usuario,
-                "contrasena_hash": hashed_password,
-                "ultimo_acceso": datetime.now()
+                "contrasena_hash": hashed_password
             }
         )
+        id_persona = result_registro.scalar_one_or_none()
 
-        db.commit()
+        if id_persona is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="El correo electrónico o el nombre de usuario ya está registrado"
+            )
+
+        await db.commit()
+        _invalidar_listados("personas")
         logger.info(f"Usuario administrador registrado exitosamente: {usuario.persona.email}")
 
         return {
@@ -290,92 +654,145 @@ def registrar_usuario(usuario: UsuarioRegistro, db: Session = Depends(get_db)):
         }
 
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error inesperado: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error interno del servidor"
         )
 
+def _consulta_historial(filtros: HistorialFiltrado, limite: int, after_id):
+    """Elige la variante precompilada del historial y arma sus parámetros"""
+    query_params = {"limite": limite}
+
+    # Filtro por nombre (sin filtro no se evalúa ningún predicado por fila)
+    con_nombre = bool(filtros.nombre)
+    if con_nombre:
+        nombre = filtros.nombre.lower()
+        query_params["nombre"] = f"%{nombre}%"
+        # Los accesos sin persona se muestran como DESCONOCIDO y también deben coincidir
+        query_params["incluir_desconocidos"] = nombre in "desconocido"
+
+    # Filtros de fecha
+    con_fechas = bool(filtros.fecha_inicio and filtros.fecha_fin)
+    if con_fechas:
+        query_params.update({
+            "fecha_inicio": filtros.fecha_inicio,
+            "fecha_fin": filtros.fecha_fin
+        })
+
+    # Filtro por resultado (valores desconocidos se ignoran)
+    resultado = filtros.resultado.upper() if filtros.resultado else None
+    if resultado not in _HISTORIAL_FILTRO_RESULTADO:
+        resultado = None
+
+    # Paginación por cursor (keyset): continuar después del último registro recibido.
+    # La fecha del cursor se toma del propio registro after_id: la respuesta solo trae la
+    # fecha formateada al minuto, que no alcanza para ubicar la posición exacta.
+    cursor = None
+    if after_id is not None:
+        cursor = "id"
+        query_params["after_id"] = after_id
+
+    return _Q_HISTORIAL[(con_nombre, con_fechas, resultado, cursor)], query_params
+
+async def _abrir_cursor(query, query_params: dict, yield_per: int):
+    """Abre un cursor del lado del servidor para transmitir un listado.
+
+    Usa una sesión propia porque la de Depends(get_db) se cierra antes de enviar
+    el cuerpo; la cierra _RespuestaCursor. La consulta se ejecuta antes de responder
+    para que un error todavía pueda devolverse como 500.
+    """
+    db = SessionLocal()
+    try:
+        result = await db.stream(
+            query,
+            query_params,
+            execution_options={"yield_per": yield_per}
+        )
+    except Exception:
+        await db.close()
+        raise
+    return db, result
+
+class _RespuestaCursor(StreamingResponse):
+    """StreamingResponse que cierra la sesión de _abrir_cursor al terminar.
+
+    El cierre no depende del generador del cuerpo: si el cliente se desconecta antes
+    de que empiece la transmisión, el generador nunca arranca y la conexión (con su
+    transacción abierta) quedaría tomada del pool hasta que la liberara el GC.
+    """
+
+    def __init__(self, db: AsyncSession, content, media_type: str = "application/json"):
+        super().__init__(content, media_type=media_type)
+        self._db = db
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Protegido de la cancelación para que el cierre termine aunque se cancele la petición
+            with anyio.CancelScope(shield=True):
+                await self._db.close()
+
+def _fila_historial(item) -> bytes:
+    return orjson.dumps({
+        "id_acceso": item["id_acceso"],
+        "nombre_completo": item["nombre_completo"],
+        "fecha": item["fecha"].strftime(FORMATO_FECHA_HORA),
+        "resultado": item["resultado"],
+        "dispositivo": item["dispositivo"],
+        "foto_url": item["foto_url"]
+    })
+
+async def _generar_arreglo_json(result, serializar, cache_key=None, generacion=None):
+    """Emite un arreglo JSON a medida que llegan las filas del cursor.
+
+    Con cache_key, el cuerpo completo se guarda en _LISTADOS_CACHE al terminar, salvo
+    que el listado se haya invalidado desde generacion (leída antes de la consulta).
+    """
+    partes = [] if cache_key else None
+    try:
+        yield b"["
+        primera = True
+        async for item in result.mappings():
+            fila = serializar(item)
+            fila = fila if primera else b"," + fila
+            if partes is not None:
+                partes.append(fila)
+            yield fila
+            primera = False
+        yield b"]"
+        if partes is not None and _LISTADOS_GENERACION[cache_key] == generacion:
+            _LISTADOS_CACHE[cache_key] = b"[" + b"".join(partes) + b"]"
+    except Exception as e:
+        logger.error(f"Error al transmitir resultados: {str(e)}", exc_info=True)
+        raise
+
+async def _generar_ndjson(result, serializar):
+    """Emite NDJSON: un objeto JSON por línea"""
+    try:
+        async for item in result.mappings():
+            yield serializar(item) + b"\n"
+    except Exception as e:
+        logger.error(f"Error al exportar resultados: {str(e)}", exc_info=True)
+        raise
+
 @app.get("/historial-accesos/", response_model=List[HistorialAcceso])
-def obtener_historial_accesos(
+async def obtener_historial_accesos(
     filtros: HistorialFiltrado = Depends(),
     limite: int = Query(20, gt=0, le=100),
-    db: Session = Depends(get_db)
+    after_id: Optional[int] = Query(None)
 ):
     try:
-        # Consulta base
-        base_query = """
-            SELECT 
-                ha.id_acceso,
-                CASE 
-                    WHEN p.nombre IS NULL THEN 'DESCONOCIDO'
-                    ELSE CONCAT(p.nombre, ' ', p.apellido_paterno, ' ', p.apellido_materno)
-                END as nombre_completo,
-                TO_CHAR(ha.fecha, 'DD/MM/YYYY – HH:MI AM') as fecha,
-                CASE 
-                    WHEN ha.resultado = 'Éxito' THEN 'PERMITIDO'
-                    ELSE 'DENEGADO'
-                END as resultado,
-                COALESCE(d.ubicacion, 'Desconocida') as dispositivo,
-                ha.foto_url
-            FROM historial_accesos ha
-            LEFT JOIN personas p ON ha.id_persona = p.id_persona
-            LEFT JOIN dispositivos d ON ha.id_dispositivo = d.id_dispositivo
-            WHERE 1=1
-        """
-        
-        query_params = {
-            "limite": limite,
-            "nombre": f"%{filtros.nombre}%" if filtros.nombre else "%"
-        }
+        query, query_params = _consulta_historial(filtros, limite, after_id)
+        db, result = await _abrir_cursor(query, query_params, yield_per=50)
 
-        # Construir condiciones dinámicas
-        conditions = []
-        
-        # Filtro por nombre
-        conditions.append("""
-            AND (
-                CASE 
-                    WHEN p.nombre IS NULL THEN 'DESCONOCIDO'
-                    ELSE CONCAT(p.nombre, ' ', p.apellido_paterno, ' ', p.apellido_materno)
-                END LIKE :nombre
-            )
-        """)
-        
-        # Filtros de fecha
-        if filtros.fecha_inicio and filtros.fecha_fin:
-            conditions.append("AND ha.fecha BETWEEN :fecha_inicio AND :fecha_fin")
-            query_params.update({
-                "fecha_inicio": filtros.fecha_inicio,
-                "fecha_fin": filtros.fecha_fin
-            })
-        
-        # Filtro por resultado
-        if filtros.resultado:
-            if filtros.resultado.upper() == 'PERMITIDO':
-                conditions.append("AND ha.resultado = 'Éxito'")
-            elif filtros.resultado.upper() == 'DENEGADO':
-                conditions.append("AND ha.resultado != 'Éxito'")
-
-        # Construir la consulta final
-        final_query = base_query + "\n".join(conditions) + "\nORDER BY ha.fecha DESC LIMIT :limite"
-        
-        result = db.execute(text(final_query), query_params)
-        historial = result.fetchall()
-
-        return [{
-            "id_acceso": item.id_acceso,
-            "nombre_completo": item.nombre_completo,
-            "fecha": item.fecha,
-            "resultado": item.resultado,
-            "dispositivo": item.dispositivo,
-            "foto_url": item.foto_url
-        } for item in historial]
+        return _RespuestaCursor(db, _generar_arreglo_json(result, _fila_historial))
 
     except Exception as e:
         logger.error(f"Error al obtener historial: {str(e)}", exc_info=True)
@@ -383,38 +800,40 @@ def obtener_historial_accesos(
             status_code=500,
             detail="Error al obtener el historial de accesos"
         )
-        
+
+@app.get("/historial-accesos.ndjson")
+async def exportar_historial_accesos(
+    filtros: HistorialFiltrado = Depends(),
+    limite: int = Query(1000, gt=0, le=10000),
+    after_id: Optional[int] = Query(None)
+):
+    """Exportación masiva del historial en NDJSON, con los mismos filtros que el listado"""
+    try:
+        query, query_params = _consulta_historial(filtros, limite, after_id)
+        db, result = await _abrir_cursor(query, query_params, yield_per=200)
+
+        return _RespuestaCursor(
+            db,
+            _generar_ndjson(result, _fila_historial),
+            media_type="application/x-ndjson"
+        )
+
+    except Exception as e:
+        logger.error(f"Error al exportar historial: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail="Error al exportar el historial de accesos"
+        )
+
 @app.get("/historial-accesos/{id_acceso}", response_model=DetalleAccesoCompleto)
-def obtener_detalle_acceso(id_acceso: int, db: Session = Depends(get_db)):
+async def obtener_detalle_acceso(id_acceso: int, db: AsyncSession = Depends(get_db)):
     try:
-        query = text("""
-            SELECT 
-                ha.id_acceso,
-                CONCAT(p.nombre, ' ', p.apellido_paterno, ' ', COALESCE(p.apellido_materno, '')) as nombre_completo,
-                TO_CHAR(ha.fecha, 'DD/MM/YYYY') as fecha,
-                TO_CHAR(ha.fecha, 'HH:MI AM') as horario,
-                hp.hora_entrada,
-                hp.hora_salida,
-                hp.dias_laborales,
-                CASE 
-                    WHEN ha.resultado = 'Éxito' THEN 'PERMITIDO'
-                    ELSE 'DENEGADO'
-                END as estatus,
-                COALESCE(d.nombre, 'Desconocido') as nombre_dispositivo,
-                COALESCE(d.ubicacion, 'Desconocida') as ubicacion_dispositivo,
-                ha.confianza,
-                ha.estado_registro,
-                ha.es_dia_laboral,
-                COALESCE(ha.razon, 'N/A') as razon,
-                ha.foto_url
-            FROM historial_accesos ha
-            LEFT JOIN personas p ON ha.id_persona = p.id_persona
-            LEFT JOIN dispositivos d ON ha.id_dispositivo = d.id_dispositivo
-            LEFT JOIN horarios_persona hp ON ha.id_persona = hp.id_persona
-            WHERE ha.id_acceso = :id_acceso
-        """)
-        result = db.execute(query, {"id_acceso": id_acceso})
-        acceso = result.fetchone()
+        detalle = _DETALLE_CACHE.get(id_acceso)
+        if detalle is not None:
+            return detalle
+
+        result = await db.execute(_Q_DETALLE_ACCESO, {"id_acceso": id_acceso})
+        acceso = result.mappings().first()
 
         if not acceso:
             raise HTTPException(
@@ -422,27 +841,29 @@ def obtener_detalle_acceso(id_acceso: int, db: Session = Depends(get_db)):
                 detail="Registro de acceso no encontrado"
             )
 
-        return {
-            "id_acceso": acceso.id_acceso,
-            "nombre_completo": acceso.nombre_completo,
-            "fecha": acceso.fecha,
-            "horario": acceso.horario,
+        detalle = {
+            "id_acceso": acceso["id_acceso"],
+            "nombre_completo": acceso["nombre_completo"],
+            "fecha": acceso["fecha"].strftime(FORMATO_FECHA),
+            "horario": acceso["fecha"].strftime(FORMATO_HORA),
             "dispositivo": {
-                "nombre": acceso.nombre_dispositivo,
-                "ubicacion": acceso.ubicacion_dispositivo
+                "nombre": acceso["nombre_dispositivo"],
+                "ubicacion": acceso["ubicacion_dispositivo"]
             },
-            "estatus": acceso.estatus,
+            "estatus": acceso["estatus"],
             "detalles_acceso": {
-                "hora_entrada": str(acceso.hora_entrada) if acceso.hora_entrada else "N/A",
-                "hora_salida": str(acceso.hora_salida) if acceso.hora_salida else "N/A"
+                "hora_entrada": str(acceso["hora_entrada"]) if acceso["hora_entrada"] else "N/A",
+                "hora_salida": str(acceso["hora_salida"]) if acceso["hora_salida"] else "N/A"
             },
-            "dias_laborales": acceso.dias_laborales,
-            "nivel_confianza": acceso.confianza * 100 if acceso.confianza else None,
-            "estado_registro": acceso.estado_registro,
-            "es_dia_laboral": acceso.es_dia_laboral,
-            "razon": acceso.razon,
-            "foto_url": acceso.foto_url
+            "dias_laborales": acceso["dias_laborales"],
+            "nivel_confianza": acceso["confianza"] * 100 if acceso["confianza"] else None,
+            "estado_registro": acceso["estado_registro"],
+            "es_dia_laboral": acceso["es_dia_laboral"],
+            "razon": acceso["razon"],
+            "foto_url": acceso["foto_url"]
         }
+        _DETALLE_CACHE[id_acceso] = detalle
+        return detalle
 
     except HTTPException:
         raise
@@ -454,44 +875,34 @@ def obtener_detalle_acceso(id_acceso: int, db: Session = Depends(get_db)):
         )
 
 @app.get("/generate-password/")
-def generate_password(password: str):
-    """Genera un hash bcrypt para contraseñas (uso en desarrollo)"""
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+@limiter.limit("10/hour")
+async def generate_password(request: Request, response: Response, password: str):
+    """Genera un hash Argon2id para contraseñas (uso en desarrollo)"""
+    hashed = await hash_service.hash_password(password)
     return {
         "original": password,
-        "hashed": hashed.decode('utf-8'),
+        "hashed": hashed,
         "warning": "No usar en producción"
     }
 
+def _fila_persona(p) -> bytes:
+    return orjson.dumps(dict(p))
+
 @app.get("/personas/", response_model=List[PersonaResponse])
-def obtener_personas(db: Session = Depends(get_db)):
+async def obtener_personas():
     try:
-        query = text("""
-            SELECT 
-                id_persona,
-                nombre,
-                apellido_paterno,
-                apellido_materno,
-                correo_electronico,
-                telefono,
-                activo,
-                fecha_registro
-            FROM personas
-            ORDER BY nombre, apellido_paterno
-        """)
-        result = db.execute(query)
-        personas = result.fetchall()
-
-        return [{
-            "id_persona": p.id_persona,
-            "nombre": p.nombre,
-            "apellido_paterno": p.apellido_paterno,
-            "apellido_materno": p.apellido_materno,
-            "correo_electronico": p.correo_electronico,
-            "telefono": p.telefono,
-            "activo": p.activo,
-            "fecha_registro": p.fecha_registro
-        } for p in personas]
+        cuerpo = _LISTADOS_CACHE.get("personas")
+        if cuerpo is not None:
+            return Response(content=cuerpo, media_type="application/json")
+
+        # Las columnas ya coinciden con PersonaResponse; se transmiten sin revalidar cada fila
+        # (response_model queda solo para la documentación) y sin cargar toda la tabla en memoria
+        generacion = _LISTADOS_GENERACION["personas"]
+        db, result = await _abrir_cursor(_Q_PERSONAS, {}, yield_per=100)
+        return _RespuestaCursor(
+            db,
+            _generar_arreglo_json(result, _fila_persona, cache_key="personas", generacion=generacion)
+        )
 
     except Exception as e:
         logger.error(f"Error al obtener personas: {str(e)}", exc_info=True)
@@ -501,37 +912,29 @@ def obtener_personas(db: Session = Depends(get_db)):
         )
 
 @app.put("/personas/{id_persona}/estado", status_code=status.HTTP_200_OK)
-def actualizar_estado_persona(
+async def actualizar_estado_persona(
     id_persona: int,
     estado: ActualizarEstadoPersona,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
-        # Verificar si la persona existe
-        persona_existente = db.execute(
-            text("SELECT 1 FROM personas WHERE id_persona = :id"),
-            {"id": id_persona}
-        ).scalar()
+        # Actualizar estado; RETURNING confirma que la persona existe
+        persona_actualizada = (await db.execute(
+            _Q_ACTUALIZAR_ESTADO,
+            {
+                "id_persona": id_persona,
+                "activo": estado.activo
+            }
+        )).scalar_one_or_none()
 
-        if not persona_existente:
+        if persona_actualizada is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Persona no encontrada"
             )
 
-        # Actualizar estado
-        db.execute(
-            text("""
-                UPDATE personas 
-                SET activo = :activo 
-                WHERE id_persona = :id_persona
-            """),
-            {
-                "id_persona": id_persona,
-                "activo": estado.activo
-            }
-        )
-        db.commit()
+        await db.commit()
+        _invalidar_listados("personas")
 
         return {
             "status": "success",
@@ -539,10 +942,10 @@ def actualizar_estado_persona(
         }
 
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error al actualizar estado: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -550,50 +953,14 @@ def actualizar_estado_persona(
         )
 
 @app.post("/reportes/", status_code=status.HTTP_201_CREATED)
-def crear_reporte(
+async def crear_reporte(
     reporte: ReporteCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
-        # Validar que el acceso relacionado existe si se proporciona
-        if reporte.id_acceso_relacionado:
-            acceso_existe = db.execute(
-                text("SELECT 1 FROM historial_accesos WHERE id_acceso = :id"),
-                {"id": reporte.id_acceso_relacionado}
-            ).scalar()
-            if not acceso_existe:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="El acceso relacionado no existe"
-                )
-
-        # Validar que el dispositivo existe si se proporciona
-        if reporte.id_dispositivo:
-            dispositivo_existe = db.execute(
-                text("SELECT 1 FROM dispositivos WHERE id_dispositivo = :id"),
-                {"id": reporte.id_dispositivo}
-            ).scalar()
-            if not dispositivo_existe:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="El dispositivo no existe"
-                )
-
-        # Insertar el reporte en la base de datos
-        result = db.execute(
-            text("""
-                INSERT INTO reportes (
-                    titulo, descripcion, tipo_reporte, severidad, estado,
-                    fecha_generacion, id_acceso_relacionado, id_dispositivo,
-                    etiquetas, evidencias
-                )
-                VALUES (
-                    :titulo, :descripcion, :tipo_reporte, :severidad, 'Abierto',
-                    CURRENT_TIMESTAMP, :id_acceso_relacionado, :id_dispositivo,
-                    :etiquetas, :evidencias
-                )
-                RETURNING id_reporte
-            """),
+        # Validar acceso y dispositivo relacionados e insertar el reporte (una sola consulta)
+        result = await db.execute(
+            _Q_INSERTAR_REPORTE,
             {
                 "titulo": reporte.titulo,
                 "descripcion": reporte.descripcion,
@@ -605,8 +972,22 @@ def crear_reporte(
                 "evidencias": reporte.evidencias
             }
         )
-        id_reporte = result.scalar_one()
-        db.commit()
+        registro = result.mappings().one()
+
+        if not registro["acceso_existe"]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="El acceso relacionado no existe"
+            )
+        if not registro["dispositivo_existe"]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="El dispositivo no existe"
+            )
+
+        id_reporte = registro["id_reporte"]
+        await db.commit()
+        _invalidar_listados("reportes")
 
         return {
             "status": "success",
@@ -615,55 +996,38 @@ def crear_reporte(
         }
 
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error al crear reporte: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error interno al crear el reporte"
         )
 
+def _fila_reporte(r) -> bytes:
+    fila = dict(r)
+    fecha_generacion = fila.pop("fecha_generacion")
+    fila["fecha"] = fecha_generacion.strftime(FORMATO_FECHA_REPORTE) if fecha_generacion else None
+    fila["hora"] = fecha_generacion.strftime(FORMATO_HORA) if fecha_generacion else None
+    return orjson.dumps(fila)
+
 @app.get("/reportes/", response_model=List[ReporteResponse])
-def obtener_reportes(db: Session = Depends(get_db)):
+async def obtener_reportes():
     try:
-        # Consulta para obtener todos los reportes
-        query = text("""
-            SELECT 
-                r.id_reporte,
-                r.titulo,
-                r.descripcion,
-                r.tipo_reporte,
-                r.severidad,
-                r.estado,
-                TO_CHAR(r.fecha_generacion, 'DD Mon YYYY') as fecha,
-                TO_CHAR(r.fecha_generacion, 'HH:MI AM') as hora,
-                COALESCE(CONCAT(p.nombre, ' ', p.apellido_paterno), 'Desconocido') as nombre,
-                COALESCE(d.ubicacion, 'N/A') as ubicacion,
-                r.evidencias
-            FROM reportes r
-            LEFT JOIN historial_accesos ha ON r.id_acceso_relacionado = ha.id_acceso
-            LEFT JOIN personas p ON ha.id_persona = p.id_persona
-            LEFT JOIN dispositivos d ON r.id_dispositivo = d.id_dispositivo
-            ORDER BY r.fecha_generacion DESC
-        """)
-        result = db.execute(query)
-        reportes = result.fetchall()
-
-        return [{
-            "id_reporte": r.id_reporte,
-            "titulo": r.titulo,
-            "descripcion": r.descripcion,
-            "tipo_reporte": r.tipo_reporte,
-            "severidad": r.severidad,
-            "estado": r.estado,
-            "fecha": r.fecha,
-            "hora": r.hora,
-            "nombre": r.nombre,
-            "ubicacion": r.ubicacion,
-            "evidencias": r.evidencias
-        } for r in reportes]
+        cuerpo = _LISTADOS_CACHE.get("reportes")
+        if cuerpo is not None:
+            return Response(content=cuerpo, media_type="application/json")
+
+        # Transmitir todos los reportes sin revalidación por fila;
+        # la fecha se formatea aquí en lugar de con TO_CHAR
+        generacion = _LISTADOS_GENERACION["reportes"]
+        db, result = await _abrir_cursor(_Q_REPORTES, {}, yield_per=100)
+        return _RespuestaCursor(
+            db,
+            _generar_arreglo_json(result, _fila_reporte, cache_key="reportes", generacion=generacion)
+        )
 
     except Exception as e:
         logger.error(f"Error al obtener reportes: {str(e)}", exc_info=True)
@@ -673,16 +1037,16 @@ def obtener_reportes(db: Session = Depends(get_db)):
         )
 
 @app.delete("/personas/{id_persona}", status_code=status.HTTP_200_OK)
-def eliminar_persona(
+async def eliminar_persona(
     id_persona: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
         # Verificar si la persona existe
-        persona_existente = db.execute(
-            text("SELECT 1 FROM personas WHERE id_persona = :id"),
+        persona_existente = (await db.execute(
+            _Q_EXISTE_PERSONA,
             {"id": id_persona}
-        ).scalar()
+        )).scalar()
 
         if not persona_existente:
             raise HTTPException(
@@ -692,11 +1056,17 @@ def eliminar_persona(
 
         # Eliminar registros relacionados en cascada
         # (gracias a ON DELETE CASCADE en la base de datos)
-        db.execute(
-            text("DELETE FROM personas WHERE id_persona = :id_persona"),
+        await db.execute(
+            _Q_ELIMINAR_PERSONA,
             {"id_persona": id_persona}
         )
-        db.commit()
+        await db.commit()
+        # Las cuentas de la persona ya no existen; evitar logins desde la caché
+        _USER_CACHE.clear()
+        _AUTH_CACHE.clear()
+        # Los reportes y el detalle de accesos muestran el nombre de la persona
+        _invalidar_listados()
+        _DETALLE_CACHE.clear()
 
         return {
             "status": "success",
@@ -704,10 +1074,10 @@ def eliminar_persona(
         }
 
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error al eliminar usuario: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -715,5 +1085,10 @@ def eliminar_persona(
         )
         
 @app.get("/health")
-def health_check():
-    return {"status": "ok", "service": "auth-api"}
+async def health_check():
+    # Cache-Control permite que el balanceador o un proxy reutilicen la respuesta unos segundos
+    return Response(
+        content=_HEALTH_BYTES,
+        media_type="application/json",
+        headers={"Cache-Control": "max-age=5"}
+    )
@@ -0,0 +1,6 @@
+-- Índice de cobertura para GET /personas/ (obtener_personas).
+-- El orden del índice ya satisface ORDER BY nombre, apellido_paterno y las
+-- columnas incluidas permiten un index-only scan sin leer el heap.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS personas_listing_covering
+    ON personas (nombre, apellido_paterno)
+    INCLUDE (id_persona, apellido_materno, correo_electronico, telefono, activo, fecha_registro);
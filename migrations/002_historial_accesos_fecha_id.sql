@@ -0,0 +1,5 @@
+-- Índice para la paginación por cursor de GET /historial-accesos/.
+-- Coincide con ORDER BY ha.fecha DESC, ha.id_acceso DESC, de modo que cada página
+-- es un range scan sobre el índice en lugar de ordenar todo el historial.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS historial_accesos_fecha_id_desc
+    ON historial_accesos (fecha DESC, id_acceso DESC);
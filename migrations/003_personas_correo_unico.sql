@@ -0,0 +1,4 @@
+-- Correo único por persona. POST /registrar/ usa ON CONFLICT (correo_electronico)
+-- en lugar de consultar antes si el correo existe.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS personas_correo_electronico_key
+    ON personas (correo_electronico);
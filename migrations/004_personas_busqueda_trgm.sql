@@ -0,0 +1,15 @@
+-- Búsqueda por nombre con índices trigram (pg_trgm) en lugar de LIKE '%...%' sobre
+-- un CONCAT calculado por fila, que obliga a recorrer toda la tabla.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE personas
+    ADD COLUMN IF NOT EXISTS nombre_busqueda text GENERATED ALWAYS AS (
+        lower(nombre || ' ' || apellido_paterno || COALESCE(' ' || apellido_materno, ''))
+    ) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_personas_nombre_busqueda_trgm
+    ON personas USING gin (nombre_busqueda gin_trgm_ops);
+
+-- Para unir rápidamente las personas encontradas con su historial
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_historial_accesos_id_persona
+    ON historial_accesos (id_persona);
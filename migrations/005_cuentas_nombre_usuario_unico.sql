@@ -0,0 +1,4 @@
+-- Nombre de usuario único. POST /registrar/ usa ON CONFLICT (nombre_usuario)
+-- en lugar de consultar antes si el usuario existe.
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS cuentas_nombre_usuario_key
+    ON cuentas (nombre_usuario);
@@ -0,0 +1,10 @@
+-- Índices parciales para GET /historial-accesos/?resultado=PERMITIDO|DENEGADO.
+-- Los predicados coinciden con _HISTORIAL_FILTRO_RESULTADO en main.py y el orden
+-- con el de la paginación por cursor (fecha, id_acceso).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS historial_accesos_exito_fecha_id_desc
+    ON historial_accesos (fecha DESC, id_acceso DESC)
+    WHERE resultado = 'Éxito';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS historial_accesos_fallo_fecha_id_desc
+    ON historial_accesos (fecha DESC, id_acceso DESC)
+    WHERE resultado <> 'Éxito';
@@ -0,0 +1,10 @@
+-- Nombre completo precalculado para el historial y su detalle, en lugar de un CONCAT
+-- por fila. Con nombre y apellido_paterno presentes da el mismo texto que
+-- CONCAT(nombre, ' ', apellido_paterno, ' ', apellido_materno), pero a diferencia de CONCAT
+-- es NULL si alguno de los dos es NULL, y también lo es en un LEFT JOIN sin persona:
+-- las consultas deben cubrir ese caso (ej. CASE WHEN p.nombre IS NULL THEN 'DESCONOCIDO').
+-- La búsqueda sigue usando nombre_busqueda (en minúsculas, con índice trigram).
+ALTER TABLE personas
+    ADD COLUMN IF NOT EXISTS nombre_completo text GENERATED ALWAYS AS (
+        nombre || ' ' || apellido_paterno || ' ' || COALESCE(apellido_materno, '')
+    ) STORED;
@@ -0,0 +1,4 @@
+-- La sal ya va incluida en contrasena_hash (formato bcrypt $2b$...), así que
+-- POST /registrar/ ya no escribe la columna sal. Se conserva con valor por
+-- defecto '' por compatibilidad con otros clientes de la base de datos.
+ALTER TABLE cuentas ALTER COLUMN sal SET DEFAULT '';
@@ -0,0 +1,3 @@
+-- Los hashes Argon2id (formato PHC, ~97 caracteres) no caben en un varchar(60)
+-- pensado para bcrypt. Cambiar a text no reescribe la tabla.
+ALTER TABLE cuentas ALTER COLUMN contrasena_hash TYPE text;
@@ -0,0 +1,8 @@
+-- Índice de cobertura para GET /historial-accesos/: mismas claves que el índice de la
+-- migración 002 más las columnas que lee el listado, de modo que cada página sale
+-- de un index-only scan sin visitar la tabla. Reemplaza al índice de la 002.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS historial_accesos_fecha_id_desc_covering
+    ON historial_accesos (fecha DESC, id_acceso DESC)
+    INCLUDE (id_persona, id_dispositivo, resultado, foto_url);
+
+DROP INDEX CONCURRENTLY IF EXISTS historial_accesos_fecha_id_desc;
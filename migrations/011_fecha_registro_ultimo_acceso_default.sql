@@ -0,0 +1,4 @@
+-- POST /registrar/ deja que la base de datos ponga la fecha de registro y el
+-- último acceso en lugar de enviar NOW() en el INSERT.
+ALTER TABLE personas ALTER COLUMN fecha_registro SET DEFAULT now();
+ALTER TABLE cuentas ALTER COLUMN ultimo_acceso SET DEFAULT now();
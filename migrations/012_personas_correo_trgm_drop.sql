@@ -0,0 +1,4 @@
+-- Ninguna consulta busca por correo, así que el índice trigram que creaba antes la
+-- migración 004 solo encarecía cada INSERT en personas. Se elimina en las bases de
+-- datos donde ya se había aplicado.
+DROP INDEX CONCURRENTLY IF EXISTS ix_personas_correo_trgm;